@@ -1,57 +1,15 @@
 import tkinter as tk
 from tkinter import ttk
 
-from xgboost import XGBClassifier
-
 from data_preprocess import *
 from predict_module import *
 import time
 
 os.environ['KMP_DUPLICATE_LIB_OK'] = 'True'
-clf = XGBClassifier()
-
-
-def load_xgb_model(model_file_name):
-    clf = XGBClassifier()
-    clf.load_model(model_file_name)
-    return clf
-
-
-def load_object(file_name):
-    print("Load object from {}".format(file_name))
-    return joblib.load(file_name)
-
-
-def load_feature_preprocessor():
-    company_type_one_hot_encoder = load_object(file_name="data/companyTypeOneHotEncoder.pickle")
-    name_tokens_one_hot_encoder = load_object(file_name="data/nameTokensOneHotEncoder.pickle")
-    education_type_one_hot_encoder = load_object(file_name="data/educationTypeOneHotEncoder.pickle")
-    position_token_one_hot_encoder = load_object(file_name="data/positionTokenOneHotEncoder.pickle")
-
-    return FeaturePreprocessor(
-        company_type_one_hot_encoder,
-        name_tokens_one_hot_encoder,
-        education_type_one_hot_encoder,
-        position_token_one_hot_encoder,
-    )
-
-
-def load_xgb_models():
-    cv_clf_path = "data/xgb_cv.model"
-    nlp_clf_path = "data/xgb_nlp.model"
-    tool_clf_path = "data/xgb_tool.model"
-    print("Load model from {}".format(cv_clf_path))
-    print("Load model from {}".format(nlp_clf_path))
-    print("Load model from {}".format(tool_clf_path))
-    cv_clf = load_xgb_model(cv_clf_path)
-    nlp_clf = load_xgb_model(nlp_clf_path)
-    tool_clf = load_xgb_model(tool_clf_path)
-    return cv_clf, nlp_clf, tool_clf
 
 
-data_preprocessor = DataPreprocessor()
-feature_preprocessor = load_feature_preprocessor()
-cv_clf, nlp_clf, tool_clf = load_xgb_models()
+data_preprocessor = load_data_preprocessor()
+feature_preprocessor, ensemble = load_pruned_scoring()
 
 
 def predict_scores(profile_url):
@@ -65,12 +23,7 @@ def predict_scores(profile_url):
     # window.update_idletasks()
     # 0.3488481044769287 1.5%
     feature_df = feature_preprocessor.transform(preprocessed_data_df)
-    # 0.07547593116760254 0.3%
-    feature_df = feature_df.rename(columns=replace_invalid_field_name_characters)
-    # 0.5326921939849854 2.2%
-    cv_y_pred = cv_clf.predict(feature_df)[0]
-    nlp_y_pred = nlp_clf.predict(feature_df)[0]
-    tool_y_pred = tool_clf.predict(feature_df)[0]
+    cv_y_pred, nlp_y_pred, tool_y_pred = score_feature_df(feature_df, ensemble)
     # my_progress['value'] += 10
     # window.update_idletasks()
     # my_progress.stop()
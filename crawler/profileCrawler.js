@@ -13,6 +13,7 @@ const options = {
 
 var args = process.argv.slice(2);
 var profile_url = args[0]
+var output_path = args[1] || 'data/profile.json'
 
 console.log("Start crawling..." + profile_url)
 
@@ -21,7 +22,7 @@ scrapedin(options)
   .then((profile) => {
     let data = JSON.stringify(profile, null, 2);
 
-    fs.writeFile('data/profile.json', data, (err) => {
+    fs.writeFile(output_path, data, (err) => {
       if (err) {
         process.exit(1);
       }
@@ -1,5 +1,8 @@
 from __future__ import print_function
 
+import argparse
+import json
+import os
 import re
 
 import nltk
@@ -11,26 +14,142 @@ from sklearn.base import BaseEstimator, TransformerMixin
 import time
 from feature.feature import experience_company_feature, experience_date_feature, experience_name_feature, \
     education_feature, position_feature
-from util import read_csv_file_as_df, build_query_by_feature
+from sharding import ShardedTransformer, THREAD_BACKEND
+from util import read_csv_file_as_df, read_json_file, build_query_by_feature
+
+# Translation gate setting the preprocessed data was built with, inference has to use the same setting
+TRANSLATION_GATE_PATH = "data/translation_gate.json"
+
+# Concurrent requests to the translation endpoint, more threads only get the requests rate limited
+TRANSLATION_THREADS = 8
+# Retries of a failed translation request before the error is raised
+MAX_TRANSLATION_RETRIES = 3
+TRANSLATION_RETRY_SECONDS = 5
+
+
+# Frequent function words and institution words of other Latin-script languages that are written without
+# diacritics, e.g. 'Universidad de Chile' or 'Technische Hochschule', so they are not mistaken for English
+NON_ENGLISH_WORDS = frozenset([
+    # Spanish / Portuguese
+    'de', 'del', 'la', 'las', 'los', 'el', 'y', 'da', 'do', 'dos', 'das', 'em', 'para', 'por', 'con', 'universidad',
+    'universidade', 'instituto', 'escuela', 'facultad', 'colegio', 'ingeniero', 'ingenieria', 'empresa',
+    # French
+    'le', 'les', 'des', 'du', 'et', 'au', 'aux', 'pour', 'universite', 'ecole', 'superieure', 'ingenieur',
+    'societe', 'sciences-po',
+    # German / Dutch
+    'der', 'die', 'das', 'und', 'fuer', 'zu', 'zur', 'von', 'technische', 'hochschule', 'universitaet',
+    'fachhochschule', 'akademie', 'gmbh', 'het', 'een', 'voor', 'en', 'universiteit', 'hogeschool',
+    # Italian
+    'di', 'della', 'delle', 'degli', 'il', 'universita', 'politecnico', 'studi', 'istituto',
+])
+
+
+class TranslationGate:
+    """
+    Cheap local check that decides whether a text has to be sent to the translator.
+
+    A text is kept as it is only when it has no letters other than ASCII ones (script check) and none of its words are
+    in a list of frequent words of other Latin-script languages (language check), e.g. 'Taiwan AILabs' is skipped
+    while '國立臺灣大學', 'Universität München' and 'Universidad de Chile' are translated.
+
+    The gate is opt-in with data_preprocess.py --translation-gate. Its setting is saved with the preprocessed data and
+    loaded by predict_module.py, so inference translates the same texts as the data the encoders were fitted on.
+    """
+
+    def __init__(self, max_non_ascii_letter_ratio=0.0, non_english_words=NON_ENGLISH_WORDS):
+        """
+        :param max_non_ascii_letter_ratio: maximum ratio of non-ASCII letters among all letters to skip translation
+        :param non_english_words: words that mark a text as not English
+        """
+        self.max_non_ascii_letter_ratio = max_non_ascii_letter_ratio
+        self.non_english_words = non_english_words
+        self.word_pattern = re.compile('[a-z]+(?:-[a-z]+)*')
+
+    def needs_translation(self, text):
+        """
+        Given a text, return whether it has to be translated.
+
+        :param text: text to check
+        :return: False if the text is empty or looks like English, True otherwise
+        """
+        letters = [char for char in str(text) if char.isalpha()]
+        if len(letters) == 0:
+            return False
+
+        non_ascii_letters = [char for char in letters if not char.isascii()]
+        if len(non_ascii_letters) > self.max_non_ascii_letter_ratio * len(letters):
+            return True
+
+        words = self.word_pattern.findall(str(text).lower())
+        return any(word in self.non_english_words for word in words)
+
+
+def save_translation_gate(translation_gate, file_path=TRANSLATION_GATE_PATH):
+    """
+    Save the setting of a translation gate, without a gate the file is removed so that no stale gate is loaded
+
+    :param translation_gate: TranslationGate or None
+    :param file_path: path of the setting file
+    """
+    if translation_gate is None:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        return
+
+    print("Save translation gate to {}".format(file_path))
+    with open(file_path, "w") as fdata:
+        json.dump({'max_non_ascii_letter_ratio': translation_gate.max_non_ascii_letter_ratio}, fdata)
+
+
+def load_translation_gate(file_path=TRANSLATION_GATE_PATH):
+    """
+    :param file_path: path of the setting file written by save_translation_gate()
+    :return: the saved TranslationGate, None if the data was preprocessed without a gate
+    """
+    if not os.path.exists(file_path):
+        return None
+
+    print("Load translation gate from {}".format(file_path))
+    return TranslationGate(**read_json_file(file_path))
 
 
 class TranslatorWrapper:
 
-    def __init__(self):
+    def __init__(self, gate=None):
+        """
+        :param gate: TranslationGate deciding which texts are sent to the translator, every text is sent if None
+        """
         self.translator = google_translator()
+        self.gate = gate
+        self.total_count = 0
+        self.skipped_count = 0
 
     def translate(self, text, dest='en'):
-        try:
-            return self.translator.translate(text, lang_tgt=dest)
-        except Exception:
-            time.sleep(5)
-            return self.translate(text, dest=dest)
+        self.total_count += 1
+        if self.gate is not None and not self.gate.needs_translation(text):
+            self.skipped_count += 1
+            return text
+        return self._translate(text, dest=dest)
+
+    def _translate(self, text, dest='en'):
+        for retry_count in range(MAX_TRANSLATION_RETRIES + 1):
+            try:
+                return self.translator.translate(text, lang_tgt=dest)
+            except Exception:
+                if retry_count == MAX_TRANSLATION_RETRIES:
+                    raise
+                time.sleep(TRANSLATION_RETRY_SECONDS)
+
+    def reset_stats(self):
+        self.total_count = 0
+        self.skipped_count = 0
 
 
 class CompanyFeaturePreprocessor(BaseEstimator, TransformerMixin):
 
-    def __init__(self):
-        self.translator = TranslatorWrapper()
+    def __init__(self, translation_gate=None):
+        self.translation_gate = translation_gate
+        self.translator = TranslatorWrapper(gate=translation_gate)
         self.replaced_word_list_pattern = re.compile('(Permanent|Full-time|Internship|Part-time)')
         self.blank_space_pattern = re.compile('\\s+')
 
@@ -52,9 +171,10 @@ class CompanyFeaturePreprocessor(BaseEstimator, TransformerMixin):
 
 class NameFeaturePreprocessor(BaseEstimator, TransformerMixin):
 
-    def __init__(self):
+    def __init__(self, translation_gate=None):
         super().__init__()
-        self.translator = TranslatorWrapper()
+        self.translation_gate = translation_gate
+        self.translator = TranslatorWrapper(gate=translation_gate)
         self.replaced_word_list_pattern = re.compile('[^0-9a-zA-Z\\s]*')
         self.blank_space_pattern = re.compile('\\s+')
 
@@ -77,9 +197,10 @@ class NameFeaturePreprocessor(BaseEstimator, TransformerMixin):
 
 
 class PositionFeaturePreprocessor(BaseEstimator, TransformerMixin):
-    def __init__(self):
+    def __init__(self, translation_gate=None):
         super().__init__()
-        self.translator = TranslatorWrapper()
+        self.translation_gate = translation_gate
+        self.translator = TranslatorWrapper(gate=translation_gate)
         self.blank_space_pattern = re.compile('\\s+')
         self.replaced_word_list_pattern = re.compile('[^0-9a-zA-Z\\s\']+')
 
@@ -100,9 +221,10 @@ class PositionFeaturePreprocessor(BaseEstimator, TransformerMixin):
 
 
 class EducationFeaturePreprocessor(BaseEstimator, TransformerMixin):
-    def __init__(self):
+    def __init__(self, translation_gate=None):
         super().__init__()
-        self.translator = TranslatorWrapper()
+        self.translation_gate = translation_gate
+        self.translator = TranslatorWrapper(gate=translation_gate)
         self.replaced_word_list_pattern = re.compile('[^0-9a-zA-Z\\s]*')
         self.blank_space_pattern = re.compile('\\s+')
 
@@ -123,10 +245,11 @@ class EducationFeaturePreprocessor(BaseEstimator, TransformerMixin):
 
 
 class DataPreprocessor(BaseEstimator, TransformerMixin):
-    def __init__(self):
+    def __init__(self, translation_gate=None):
+        self.translation_gate = translation_gate
         self.transformer_field_mapping = [
             (
-                CompanyFeaturePreprocessor(),
+                CompanyFeaturePreprocessor(translation_gate),
                 experience_company_feature
             ),
             (
@@ -134,20 +257,44 @@ class DataPreprocessor(BaseEstimator, TransformerMixin):
                 experience_date_feature
             ),
             (
-                NameFeaturePreprocessor(),
+                NameFeaturePreprocessor(translation_gate),
                 experience_name_feature
             ),
             (
-                EducationFeaturePreprocessor(),
+                EducationFeaturePreprocessor(translation_gate),
                 education_feature
             ),
             (
-                PositionFeaturePreprocessor(),
+                PositionFeaturePreprocessor(translation_gate),
                 position_feature
             )
         ]
+        self.translation_stats_ = {}
 
-    def transform(self, X, **transform_params):
+    def fit(self, X, y=None, **fit_params):
+        return self
+
+    def get_transform_stats(self):
+        """
+        :return: dict of feature name to (skipped translation count, total translation count) of the last transform()
+        """
+        return dict(self.translation_stats_)
+
+    def report_transform_stats(self, stats):
+        # Without a gate every value is translated, so there is nothing to report
+        if self.translation_gate is None:
+            return
+        for field_name, (skipped_count, total_count) in stats.items():
+            skipped_ratio = skipped_count / total_count if total_count > 0 else 0.0
+            print("Skipped translation for {:.1%} of {} {} values".format(skipped_ratio, total_count, field_name))
+
+    def transform(self, X, report_stats=True, **transform_params):
+        """
+        :param X: profile df
+        :param report_stats: print the translation stats of every feature, ShardedTransformer reports them once for
+            all shards instead
+        :return: preprocessed df
+        """
         input_df = X
         df_list = []
         for mapping in self.transformer_field_mapping:
@@ -157,21 +304,42 @@ class DataPreprocessor(BaseEstimator, TransformerMixin):
             sub_df = pdsql.sqldf(query, locals())
             transformer = mapping[0]
             if transformer is not None:
+                transformer.translator.reset_stats()
                 sub_feature_df = transformer.transform(sub_df)
+                self.translation_stats_[feature.field_name] = (transformer.translator.skipped_count,
+                                                               transformer.translator.total_count)
             else:
                 sub_feature_df = sub_df
             df_list.append(sub_feature_df)
             print()
 
+        if report_stats:
+            self.report_transform_stats(self.get_transform_stats())
         return pd.concat(df_list, axis=1)
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Translate and clean the profile fields of the labeled data")
+    parser.add_argument('--translation-gate', action='store_true',
+                        help="only send the values that do not look like English to the translator")
+    parser.add_argument('--max-non-ascii-letter-ratio', type=float, default=0.0,
+                        help="maximum ratio of non-ASCII letters of a value the gate keeps as it is")
+    parser.add_argument('--translation-threads', type=int, default=TRANSLATION_THREADS,
+                        help="number of concurrent translation requests")
+    args = parser.parse_args()
+
     data_path = "data/data_with_labels.csv"
     preprocessed_data_path = "data/preprocessed_data.csv"
     input_data = read_csv_file_as_df(data_path)
 
-    data_preprocessor = DataPreprocessor()
+    translation_gate = None
+    if args.translation_gate:
+        translation_gate = TranslationGate(max_non_ascii_letter_ratio=args.max_non_ascii_letter_ratio)
+
+    # Translation waits on the network, so the thread count is bounded by the endpoint rather than the cores
+    data_preprocessor = ShardedTransformer(DataPreprocessor(translation_gate), n_jobs=args.translation_threads,
+                                           backend=THREAD_BACKEND)
     preprocessed_data_df = data_preprocessor.transform(input_data)
     preprocessed_data_df.to_csv(preprocessed_data_path, index=False)
+    save_translation_gate(translation_gate)
     print("Preprocessed file has been saved to {}.".format(preprocessed_data_path))
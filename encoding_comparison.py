@@ -0,0 +1,56 @@
+import os
+import time
+
+from sklearn.model_selection import StratifiedKFold, cross_val_score
+from xgboost import XGBClassifier
+
+from feature_preprocess import build_feature_preprocessor, VOCABULARY_ENCODING, HASHING_ENCODING
+from util import read_csv_file_as_df, replace_invalid_field_name_characters
+
+os.environ['KMP_DUPLICATE_LIB_OK'] = 'True'
+
+
+def build_model_input(feature_preprocessor, preprocessed_data_df):
+    start_time = time.time()
+    feature_df = feature_preprocessor.fit_transform(preprocessed_data_df)
+    feature_df = feature_df.rename(columns=replace_invalid_field_name_characters)
+    return feature_df, time.time() - start_time
+
+
+if __name__ == '__main__':
+    data_path = "data/data_with_labels.csv"
+    preprocessed_data_path = "data/preprocessed_data.csv"
+    input_data = read_csv_file_as_df(data_path)
+    preprocessed_data_df = read_csv_file_as_df(preprocessed_data_path)
+
+    label_types = [
+        'CV',
+        'Tool',
+        'NLP'
+    ]
+    encodings = [
+        VOCABULARY_ENCODING,
+        HASHING_ENCODING
+    ]
+
+    results = []
+    for encoding in encodings:
+        feature_preprocessor = build_feature_preprocessor(
+            company_encoding=encoding,
+            name_encoding=encoding,
+            education_encoding=encoding,
+            position_encoding=encoding,
+        )
+        X, encoding_seconds = build_model_input(feature_preprocessor, preprocessed_data_df)
+
+        for label_type in label_types:
+            print("Evaluating {} encoding with label name: {}".format(encoding, label_type))
+            y = input_data[label_type]
+            cv = StratifiedKFold(n_splits=5, shuffle=True, random_state=42)
+            scores = cross_val_score(XGBClassifier(), X, y, cv=cv, scoring='accuracy')
+            results.append((encoding, label_type, X.shape[1], encoding_seconds, scores.mean(), scores.std()))
+
+    print("{:<12}{:<8}{:>10}{:>14}{:>12}{:>10}".format("encoding", "label", "columns", "encode (s)", "accuracy", "std"))
+    for encoding, label_type, column_size, encoding_seconds, accuracy, std in results:
+        print("{:<12}{:<8}{:>10}{:>14.2f}{:>12.4f}{:>10.4f}".format(
+            encoding, label_type, column_size, encoding_seconds, accuracy, std))
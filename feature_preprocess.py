@@ -1,35 +1,133 @@
 from __future__ import print_function
 
 import joblib
+import numpy as np
 import pandas as pd
 import pandasql as pdsql
 from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.feature_extraction import FeatureHasher
 from sklearn.pipeline import Pipeline
 from sklearn.preprocessing import MultiLabelBinarizer
 
 from feature.feature import experience_company_feature, experience_date_feature, experience_name_feature, \
     education_feature, position_feature
-from feature.preprocess.process_date import generate_on_job_status_df
-from util import read_csv_file_as_df, build_query_by_feature
+from feature.preprocess.process_date import get_on_job_year_span
+from sharding import ShardedTransformer
+from util import read_csv_file_as_df, build_query_by_feature, replace_invalid_field_name_characters
 
 
 def add_prefix_to_column(prefix, df):
     df.columns = list(map(lambda column_name: prefix + "/" + column_name, df.columns))
 
 
-class DateRangeFeatureTransformer(BaseEstimator, TransformerMixin):
+class PrunableFeatureMixin:
+    """
+    Mixin for feature transformers whose output columns are named '<input column>/<class>'. After prune() is called
+    with the output columns a model uses, transform() only computes those columns.
+    Subclasses provide get_classes() returning the classes of one input column.
+    """
+    kept_classes_ = None
+
+    def get_input_columns(self, columns):
+        return list(columns)
+
+    def get_feature_names(self, columns):
+        """
+        :param columns: input column names
+        :return: output column names of transform(), only the kept ones if the transformer is pruned
+        """
+        if self.kept_classes_ is None:
+            return [column + "/" + cls for column in self.get_input_columns(columns) for cls in self.get_classes()]
+        return [column + "/" + cls for column, classes in self.kept_classes_.items() for cls in classes]
+
+    def prune(self, columns, kept_feature_names):
+        """
+        Keep only the given output columns in transform()
+
+        :param columns: input column names
+        :param kept_feature_names: output column names to keep
+        :return: instance itself
+        """
+        kept_feature_names = set(kept_feature_names)
+        self.kept_classes_ = {}
+        for column in self.get_input_columns(columns):
+            self.kept_classes_[column] = [
+                cls for cls in self.get_classes() if column + "/" + cls in kept_feature_names
+            ]
+        return self
+
+    def transform_kept_classes(self, X, get_kept_class_values):
+        """
+        Build the df of the kept columns
+
+        :param X: input df
+        :param get_kept_class_values: function(column values, kept classes) returning one value array per class
+        :return: df with the kept columns only
+        """
+        data = {}
+        for column_name in self.get_input_columns(X.columns):
+            classes = self.kept_classes_.get(column_name, [])
+            if len(classes) == 0:
+                continue
+            for cls, values in zip(classes, get_kept_class_values(X[column_name], classes)):
+                data[column_name + "/" + cls] = values
+        return pd.DataFrame(data, index=range(len(X)), columns=list(data.keys()), dtype=np.int64)
+
+
+class DateRangeFeatureTransformer(PrunableFeatureMixin, BaseEstimator, TransformerMixin):
+    """
+    On job status per year of the first date range, e.g. 'Jan 2019 – Present' sets the columns from 2019 on to 1.
+    The year window is fixed by fit(), so a row only needs its first and last year to fill all the columns.
+    """
+
+    def __init__(self, start_year=1980, end_year=2020):
+        """
+        :param start_year: first year of the on job status columns
+        :param end_year: last year of the on job status columns, experience after it is ignored
+        """
+        self.start_year = start_year
+        self.end_year = end_year
 
     def fit(self, X, y=None, **fit_params):
         print("Fitting X by DateRangeFeatureTransformer")
+        self.years_ = np.arange(self.start_year, self.end_year + 1)
+        self.year_names_ = [str(year) for year in self.years_]
         return self
 
+    def get_classes(self):
+        return self.year_names_
+
+    def get_input_columns(self, columns):
+        # Only the first date range is used
+        return list(columns)[:1]
+
+    def get_on_job_status(self, values):
+        """
+        :param values: date range strings like 'May 2019 – Present'
+        :return: int matrix of shape (len(values), number of years), 1 if the year is in the date range
+        """
+        start_years = np.full(len(values), self.end_year + 1)
+        end_years = np.full(len(values), self.start_year - 1)
+        for i, value in enumerate(values):
+            year_span = get_on_job_year_span(value)
+            if year_span is not None:
+                start_years[i], end_years[i] = year_span
+        on_job_status = (self.years_ >= start_years[:, None]) & (self.years_ <= end_years[:, None])
+        return on_job_status.astype(np.int64)
+
     def transform(self, X, **transform_params):
         print("Transforming X by DateRangeFeatureTransformer")
-        on_job_status_df = generate_on_job_status_df(X)
-        return on_job_status_df
+        if self.kept_classes_ is not None:
+            year_index = {year_name: i for i, year_name in enumerate(self.year_names_)}
+            return self.transform_kept_classes(X, lambda values, classes: self.get_on_job_status(
+                values.tolist())[:, [year_index[cls] for cls in classes]].T)
 
+        column_name = X.columns[0]
+        columns = [column_name + "/" + year_name for year_name in self.year_names_]
+        return pd.DataFrame(self.get_on_job_status(X[column_name].tolist()), columns=columns)
 
-class TypeOneHotFeatureTransformer(BaseEstimator, TransformerMixin):
+
+class TypeOneHotFeatureTransformer(PrunableFeatureMixin, BaseEstimator, TransformerMixin):
     def __init__(self):
         self.mlb = MultiLabelBinarizer()
 
@@ -47,8 +145,15 @@ class TypeOneHotFeatureTransformer(BaseEstimator, TransformerMixin):
         self.mlb.fit(total_data)
         return self
 
+    def get_classes(self):
+        return list(self.mlb.classes_)
+
     def transform(self, X, **transform_params):
         print("Transforming X by TypeOneHotFeatureTransformer")
+        if self.kept_classes_ is not None:
+            return self.transform_kept_classes(
+                X, lambda values, classes: [(values == cls).astype(np.int64).values for cls in classes])
+
         df_list = []
         classes = self.mlb.classes_
 
@@ -64,7 +169,7 @@ class TypeOneHotFeatureTransformer(BaseEstimator, TransformerMixin):
         return pd.concat(df_list, axis=1)
 
 
-class TokensOneHotFeatureTransformer(BaseEstimator, TransformerMixin):
+class TokensOneHotFeatureTransformer(PrunableFeatureMixin, BaseEstimator, TransformerMixin):
 
     def __init__(self):
         self.mlb = MultiLabelBinarizer()
@@ -92,6 +197,9 @@ class TokensOneHotFeatureTransformer(BaseEstimator, TransformerMixin):
         self.mlb.fit(total_data)
         return self
 
+    def get_classes(self):
+        return list(self.mlb.classes_)
+
     def transform(self, X, **transform_params):
         """
         Form the feature value base on mlb vector space from the fit() result
@@ -100,6 +208,9 @@ class TokensOneHotFeatureTransformer(BaseEstimator, TransformerMixin):
         :return: feature value df like [[0, 0, ...], [1, 0, ...]]
         """
         print("Transforming X by TokensOneHotFeatureTransformer")
+        if self.kept_classes_ is not None:
+            return self.transform_kept_classes(X, get_kept_token_values)
+
         df_list = []
         classes = self.mlb.classes_
 
@@ -115,6 +226,122 @@ class TokensOneHotFeatureTransformer(BaseEstimator, TransformerMixin):
         return pd.concat(df_list, axis=1)
 
 
+def get_kept_token_values(values, classes):
+    token_sets = [set(str(value).split(',')) for value in values]
+    return [np.array([cls in tokens for tokens in token_sets], dtype=np.int64) for cls in classes]
+
+
+def hash_values_to_df(hasher, hasher_input, prefix):
+    """
+    Hash lists of strings into a binary df with one column per hash bucket. The df keeps the sparse matrix of the
+    hasher, so a row only takes memory for the buckets its values fall into.
+
+    :param hasher: a FeatureHasher with input_type='string'
+    :param hasher_input: list of list of strings like [['data','engineer'], [..., ...]]
+    :param prefix: prefix of the column names
+    :return: sparse df like [[0, 1, ...], [1, 0, ...]] with columns like 'prefix/hash_0'
+    """
+    hashed_matrix = hasher.transform(hasher_input)
+    hashed_matrix.data = (hashed_matrix.data > 0).astype(np.int64)
+    hashed_matrix.eliminate_zeros()
+    columns = ["hash_{}".format(i) for i in range(hasher.n_features)]
+    data_df = pd.DataFrame.sparse.from_spmatrix(hashed_matrix, columns=columns)
+    add_prefix_to_column(prefix, data_df)
+    return data_df
+
+
+def get_kept_hash_values(hasher, hasher_input, classes):
+    hashed_matrix = hasher.transform(hasher_input).tocsc()
+    kept_indices = [int(cls[len("hash_"):]) for cls in classes]
+    return (hashed_matrix[:, kept_indices].toarray() > 0).astype(np.int64).T
+
+
+class TypeHashingFeatureTransformer(PrunableFeatureMixin, BaseEstimator, TransformerMixin):
+    """
+    Same input as TypeOneHotFeatureTransformer, but each value is hashed into n_features columns per field so no
+    vocabulary has to be built and the output width does not depend on the corpus.
+    """
+
+    def __init__(self, n_features=256):
+        self.n_features = n_features
+
+    def fit(self, X, y=None, **fit_params):
+        print("Fitting X by TypeHashingFeatureTransformer")
+        self.hasher_ = FeatureHasher(n_features=self.n_features, input_type='string', alternate_sign=False)
+        return self
+
+    def get_classes(self):
+        return ["hash_{}".format(i) for i in range(self.n_features)]
+
+    def transform(self, X, **transform_params):
+        print("Transforming X by TypeHashingFeatureTransformer")
+        if self.kept_classes_ is not None:
+            return self.transform_kept_classes(X, lambda values, classes: get_kept_hash_values(
+                self.hasher_, [[str(value)] for value in values], classes))
+
+        df_list = []
+        for column_index, column_name in enumerate(X.columns):
+            hasher_input = [[str(value)] for value in X.iloc[:, column_index]]
+            df_list.append(hash_values_to_df(self.hasher_, hasher_input, column_name))
+        return pd.concat(df_list, axis=1)
+
+
+class TokensHashingFeatureTransformer(PrunableFeatureMixin, BaseEstimator, TransformerMixin):
+    """
+    Same input as TokensOneHotFeatureTransformer, but the tokens are hashed into n_features columns per field so no
+    vocabulary has to be built and the output width does not depend on the corpus.
+    """
+
+    def __init__(self, n_features=256):
+        self.n_features = n_features
+
+    def fit(self, X, y=None, **fit_params):
+        print("Fitting X by TokensHashingFeatureTransformer")
+        self.hasher_ = FeatureHasher(n_features=self.n_features, input_type='string', alternate_sign=False)
+        return self
+
+    def get_classes(self):
+        return ["hash_{}".format(i) for i in range(self.n_features)]
+
+    def transform(self, X, **transform_params):
+        print("Transforming X by TokensHashingFeatureTransformer")
+        if self.kept_classes_ is not None:
+            return self.transform_kept_classes(X, lambda values, classes: get_kept_hash_values(
+                self.hasher_, [str(value).split(',') for value in values], classes))
+
+        df_list = []
+        for column_index, column_name in enumerate(X.columns):
+            hasher_input = [str(value).split(',') for value in X.iloc[:, column_index]]
+            df_list.append(hash_values_to_df(self.hasher_, hasher_input, column_name))
+        return pd.concat(df_list, axis=1)
+
+
+VOCABULARY_ENCODING = "vocabulary"
+HASHING_ENCODING = "hashing"
+
+
+def create_type_encoder(encoding=VOCABULARY_ENCODING, n_features=256):
+    if encoding == VOCABULARY_ENCODING:
+        return TypeOneHotFeatureTransformer()
+    elif encoding == HASHING_ENCODING:
+        return TypeHashingFeatureTransformer(n_features=n_features)
+    raise ValueError("Unknown encoding: {}".format(encoding))
+
+
+def create_tokens_encoder(encoding=VOCABULARY_ENCODING, n_features=256):
+    if encoding == VOCABULARY_ENCODING:
+        return TokensOneHotFeatureTransformer()
+    elif encoding == HASHING_ENCODING:
+        return TokensHashingFeatureTransformer(n_features=n_features)
+    raise ValueError("Unknown encoding: {}".format(encoding))
+
+
+def get_final_transformer(transformer):
+    if isinstance(transformer, Pipeline):
+        return transformer.steps[-1][1]
+    return transformer
+
+
 def save_object(obj, file_name):
     print("Save object to {}".format(file_name))
     joblib.dump(obj, file_name, compress=1)
@@ -123,11 +350,12 @@ def save_object(obj, file_name):
 
 class FeaturePreprocessor(BaseEstimator, TransformerMixin):
     def __init__(self, company_type_one_hot_encoder, name_tokens_one_hot_encoder, education_type_one_hot_encoder,
-                 position_token_one_hot_encoder):
+                 position_token_one_hot_encoder, date_range_feature_transformer):
         self.company_type_one_hot_encoder = company_type_one_hot_encoder
         self.name_tokens_one_hot_encoder = name_tokens_one_hot_encoder
         self.education_type_one_hot_encoder = education_type_one_hot_encoder
         self.position_token_one_hot_encoder = position_token_one_hot_encoder
+        self.date_range_feature_transformer = date_range_feature_transformer
 
         self.transformer_field_mapping = [
             (
@@ -137,7 +365,7 @@ class FeaturePreprocessor(BaseEstimator, TransformerMixin):
                 experience_company_feature
             ),
             (
-                DateRangeFeatureTransformer(),
+                self.date_range_feature_transformer,
                 experience_date_feature
             ),
             (
@@ -161,6 +389,34 @@ class FeaturePreprocessor(BaseEstimator, TransformerMixin):
             )
         ]
 
+    def get_feature_names(self):
+        """
+        :return: output column names of transform() before replace_invalid_field_name_characters
+        """
+        feature_names = []
+        for mapping in self.transformer_field_mapping:
+            transformer = get_final_transformer(mapping[0])
+            feature_names.extend(transformer.get_feature_names(mapping[1].get_csv_field_names()))
+        return feature_names
+
+    def prune(self, used_feature_names):
+        """
+        Keep only the columns used by the models, the other columns are implied to be 0
+
+        :param used_feature_names: model feature names, i.e. after replace_invalid_field_name_characters
+        :return: instance itself
+        """
+        used_feature_names = set(used_feature_names)
+        for mapping in self.transformer_field_mapping:
+            transformer = get_final_transformer(mapping[0])
+            columns = mapping[1].get_csv_field_names()
+            kept_feature_names = [
+                feature_name for feature_name in transformer.get_feature_names(columns)
+                if replace_invalid_field_name_characters(feature_name) in used_feature_names
+            ]
+            transformer.prune(columns, kept_feature_names)
+        return self
+
     def fit(self, X, y=None, **fit_params):
         for mapping in self.transformer_field_mapping:
             feature = mapping[1]
@@ -188,6 +444,28 @@ class FeaturePreprocessor(BaseEstimator, TransformerMixin):
         return pd.concat(df_list, axis=1)
 
 
+def build_feature_preprocessor(company_encoding=VOCABULARY_ENCODING, name_encoding=VOCABULARY_ENCODING,
+                               education_encoding=VOCABULARY_ENCODING, position_encoding=VOCABULARY_ENCODING,
+                               n_features=256):
+    """
+    Build an unfitted FeaturePreprocessor with the encoding of each feature chosen separately
+
+    :param company_encoding: VOCABULARY_ENCODING or HASHING_ENCODING for the experience company feature
+    :param name_encoding: VOCABULARY_ENCODING or HASHING_ENCODING for the experience name feature
+    :param education_encoding: VOCABULARY_ENCODING or HASHING_ENCODING for the education feature
+    :param position_encoding: VOCABULARY_ENCODING or HASHING_ENCODING for the position feature
+    :param n_features: number of hash buckets per field when HASHING_ENCODING is used
+    :return: a FeaturePreprocessor
+    """
+    return FeaturePreprocessor(
+        create_type_encoder(company_encoding, n_features),
+        create_tokens_encoder(name_encoding, n_features),
+        create_type_encoder(education_encoding, n_features),
+        create_tokens_encoder(position_encoding, n_features),
+        DateRangeFeatureTransformer(),
+    )
+
+
 if __name__ == '__main__':
     data_path = "data/data_with_labels.csv"
     model_input_file_path = "data/model_input.csv"
@@ -196,23 +474,26 @@ if __name__ == '__main__':
 
     preprocessed_data_df = read_csv_file_as_df(preprocessed_data_path)
 
-    company_type_one_hot_encoder = TypeOneHotFeatureTransformer()
-    name_tokens_one_hot_encoder = TokensOneHotFeatureTransformer()
-    education_type_one_hot_encoder = TypeOneHotFeatureTransformer()
-    position_token_one_hot_encoder = TokensOneHotFeatureTransformer()
-
-    feature_preprocessor = FeaturePreprocessor(
-        company_type_one_hot_encoder,
-        name_tokens_one_hot_encoder,
-        education_type_one_hot_encoder,
-        position_token_one_hot_encoder,
+    # Use HASHING_ENCODING for a feature to get a fixed width encoder that needs no vocabulary
+    feature_preprocessor = build_feature_preprocessor(
+        company_encoding=VOCABULARY_ENCODING,
+        name_encoding=VOCABULARY_ENCODING,
+        education_encoding=VOCABULARY_ENCODING,
+        position_encoding=VOCABULARY_ENCODING,
     )
 
-    feature_preprocessed = feature_preprocessor.fit_transform(preprocessed_data_df)
-    save_object(obj=company_type_one_hot_encoder, file_name="data/companyTypeOneHotEncoder.pickle")
-    save_object(obj=name_tokens_one_hot_encoder, file_name="data/nameTokensOneHotEncoder.pickle")
-    save_object(obj=education_type_one_hot_encoder, file_name="data/educationTypeOneHotEncoder.pickle")
-    save_object(obj=position_token_one_hot_encoder, file_name="data/positionTokenOneHotEncoder.pickle")
+    feature_preprocessor.fit(preprocessed_data_df)
+    feature_preprocessed = ShardedTransformer(feature_preprocessor).transform(preprocessed_data_df)
+    save_object(obj=feature_preprocessor.company_type_one_hot_encoder,
+                file_name="data/companyTypeOneHotEncoder.pickle")
+    save_object(obj=feature_preprocessor.name_tokens_one_hot_encoder,
+                file_name="data/nameTokensOneHotEncoder.pickle")
+    save_object(obj=feature_preprocessor.education_type_one_hot_encoder,
+                file_name="data/educationTypeOneHotEncoder.pickle")
+    save_object(obj=feature_preprocessor.position_token_one_hot_encoder,
+                file_name="data/positionTokenOneHotEncoder.pickle")
+    save_object(obj=feature_preprocessor.date_range_feature_transformer,
+                file_name="data/dateRangeFeatureTransformer.pickle")
 
     # append label
     label_query = 'select NLP, CV, Tool from input_data;'
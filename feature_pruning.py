@@ -0,0 +1,63 @@
+import time
+
+from predict_module import *
+from tree_evaluator import compile_xgb_models
+
+os.environ['KMP_DUPLICATE_LIB_OK'] = 'True'
+
+
+def prune_for_models(feature_preprocessor, models, model_names):
+    """
+    Prune the feature preprocessor to the columns the models split on and compile the models against the pruned
+    columns
+
+    :param feature_preprocessor: a fitted FeaturePreprocessor, it is pruned in place
+    :param models: list of XGBClassifier trained on the full output of the feature preprocessor
+    :param model_names: list of model names like ['cv', 'nlp', 'tool']
+    :return: a CompiledTreeEnsemble that reads the pruned feature df
+    """
+    feature_names = list(map(replace_invalid_field_name_characters, feature_preprocessor.get_feature_names()))
+    ensemble = compile_xgb_models(models, model_names, feature_names=feature_names)
+    feature_preprocessor.prune(ensemble.get_used_feature_names())
+
+    pruned_feature_names = list(map(replace_invalid_field_name_characters, feature_preprocessor.get_feature_names()))
+    print("Pruned features from {} to {} columns".format(len(feature_names), len(pruned_feature_names)))
+    return ensemble.select_features(pruned_feature_names)
+
+
+def build_feature_df(feature_preprocessor, preprocessed_data_df):
+    start_time = time.time()
+    feature_df = feature_preprocessor.transform(preprocessed_data_df)
+    feature_df = feature_df.rename(columns=replace_invalid_field_name_characters)
+    return feature_df, time.time() - start_time
+
+
+if __name__ == '__main__':
+    preprocessed_data_path = "data/preprocessed_data.csv"
+    compiled_trees_path = "data/xgb_pruned_trees.npz"
+
+    # Export the pruned schema with the matching compiled trees for load_pruned_scoring()
+    models = load_xgb_models()
+    ensemble = prune_for_models(load_feature_preprocessor(), models, model_names)
+    ensemble.metadata['source_fingerprint'] = get_files_fingerprint(scoring_source_paths)
+    ensemble.save(compiled_trees_path)
+
+    # Compare the full XGBoost path with the pruned path loaded from the export
+    preprocessed_data_df = read_csv_file_as_df(preprocessed_data_path)
+    full_feature_df, full_seconds = build_feature_df(load_feature_preprocessor(), preprocessed_data_df)
+
+    pruned_feature_preprocessor, pruned_ensemble = load_pruned_scoring(compiled_trees_path)
+    pruned_feature_df, pruned_seconds = build_feature_df(pruned_feature_preprocessor, preprocessed_data_df)
+
+    pruned_pred = pruned_ensemble.predict(pruned_feature_df.values)
+    for model_name, clf in zip(model_names, models):
+        label_match = (clf.predict(full_feature_df) == pruned_pred[model_name]).mean()
+        print("{}: label match {:.2%}".format(model_name, label_match))
+
+    row_size = len(preprocessed_data_df)
+    print("Full features: {} columns, {:.2f} ms per row, {:.1f} KB per row".format(
+        full_feature_df.shape[1], full_seconds / row_size * 1000,
+        full_feature_df.memory_usage().sum() / row_size / 1024))
+    print("Pruned features: {} columns, {:.2f} ms per row, {:.1f} KB per row".format(
+        pruned_feature_df.shape[1], pruned_seconds / row_size * 1000,
+        pruned_feature_df.memory_usage().sum() / row_size / 1024))
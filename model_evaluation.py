@@ -0,0 +1,221 @@
+import argparse
+import hashlib
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from joblib import Parallel, delayed
+from sklearn.metrics import log_loss
+from sklearn.model_selection import ParameterGrid, StratifiedKFold, train_test_split
+
+from model_training import handle_imbalanced_data
+from tree_evaluator import CompiledTreeEnsemble
+from util import read_csv_file_as_df, replace_invalid_field_name_characters
+
+os.environ['KMP_DUPLICATE_LIB_OK'] = 'True'
+
+label_types = [
+    'CV',
+    'Tool',
+    'NLP'
+]
+
+
+def get_cache_folder(data_path, cache_root, n_splits, random_state, early_stopping_fraction, feature_names=None):
+    """
+    Return the cache folder of a model input file, a changed file, split setting or feature selection gets a new
+    folder
+
+    :param data_path: path of the model input csv
+    :param cache_root: folder that holds the caches
+    :param n_splits: number of folds
+    :param random_state: seed of the fold split
+    :param early_stopping_fraction: fraction of each training fold held out for early stopping
+    :param feature_names: feature columns to evaluate on, all columns if None
+    :return: cache folder path
+    """
+    fingerprint = "{}|{}|{}|{}|{}|{}|{}".format(os.path.abspath(data_path), os.path.getmtime(data_path),
+                                                os.path.getsize(data_path), n_splits, random_state,
+                                                early_stopping_fraction, feature_names)
+    cache_folder = os.path.join(cache_root, hashlib.md5(fingerprint.encode('utf-8')).hexdigest())
+    if not os.path.exists(cache_folder):
+        os.makedirs(cache_folder)
+    return cache_folder
+
+
+def get_fold_matrix_paths(cache_folder, label_type, fold_index):
+    """
+    :return: paths of the train, early stopping and validation matrices of a fold
+    """
+    prefix = os.path.join(cache_folder, "{}_fold{}".format(label_type.lower(), fold_index))
+    return prefix + "_train.buffer", prefix + "_stop.buffer", prefix + "_valid.buffer"
+
+
+def prepare_fold_matrices(data_path, cache_folder, n_splits=5, random_state=42, early_stopping_fraction=0.2,
+                          feature_names=None):
+    """
+    Build the fold splits and the XGBoost matrices of every label once and save them to the cache folder.
+    Part of the training part of each fold is held out for early stopping, so the validation part is only used for
+    the reported scores. The rest of the training part is oversampled like model_training.py does.
+
+    :param data_path: path of the model input csv
+    :param cache_folder: folder for the fold indices and matrices
+    :param n_splits: number of folds
+    :param random_state: seed of the fold split
+    :param early_stopping_fraction: fraction of each training fold held out for early stopping
+    :param feature_names: feature columns to evaluate on, e.g. the pruned schema of the compiled trees, all columns if
+        None
+    :return: dict of label type to number of classes
+    """
+    class_count_path = os.path.join(cache_folder, "class_counts.csv")
+    if os.path.exists(class_count_path):
+        print("Use cached fold matrices in {}".format(cache_folder))
+        class_count_df = pd.read_csv(class_count_path)
+        return dict(zip(class_count_df['label'], class_count_df['class_count']))
+
+    print("Building fold matrices from {}".format(data_path))
+    input_data = read_csv_file_as_df(data_path)
+    input_data = input_data.rename(columns=replace_invalid_field_name_characters)
+    X = input_data.drop(label_types, axis=1)
+    if feature_names is not None:
+        X = X[feature_names]
+    feature_names = list(X.columns)
+    X = X.values.astype(np.float32)
+
+    class_counts = {}
+    for label_type in label_types:
+        y = input_data[label_type].values
+        class_counts[label_type] = int(y.max()) + 1
+
+        kfold = StratifiedKFold(n_splits=n_splits, shuffle=True, random_state=random_state)
+        fold_indices = {}
+        for fold_index, (train_index, valid_index) in enumerate(kfold.split(X, y)):
+            train_index, stop_index = train_test_split(train_index, test_size=early_stopping_fraction,
+                                                       stratify=y[train_index], random_state=random_state)
+            fold_indices["train_{}".format(fold_index)] = train_index
+            fold_indices["stop_{}".format(fold_index)] = stop_index
+            fold_indices["valid_{}".format(fold_index)] = valid_index
+
+            X_train, y_train = handle_imbalanced_data(X[train_index], y[train_index])
+            train_path, stop_path, valid_path = get_fold_matrix_paths(cache_folder, label_type, fold_index)
+            xgb.DMatrix(X_train, label=y_train, feature_names=feature_names).save_binary(train_path)
+            xgb.DMatrix(X[stop_index], label=y[stop_index], feature_names=feature_names).save_binary(stop_path)
+            xgb.DMatrix(X[valid_index], label=y[valid_index], feature_names=feature_names).save_binary(valid_path)
+        np.savez(os.path.join(cache_folder, "folds_{}.npz".format(label_type.lower())), **fold_indices)
+
+    pd.DataFrame({'label': list(class_counts.keys()), 'class_count': list(class_counts.values())}).to_csv(
+        class_count_path, index=False)
+    return class_counts
+
+
+def evaluate_fold(cache_folder, label_type, class_count, params, fold_index, num_boost_round,
+                  early_stopping_rounds):
+    """
+    Train on the training part of a fold with early stopping on its held out part, and score on its validation part
+
+    :return: dict with the label, parameters, fold, best iteration, validation accuracy and log loss, early stopping
+        log loss and training seconds
+    """
+    train_path, stop_path, valid_path = get_fold_matrix_paths(cache_folder, label_type, fold_index)
+    dtrain = xgb.DMatrix(train_path)
+    dstop = xgb.DMatrix(stop_path)
+    dvalid = xgb.DMatrix(valid_path)
+
+    train_params = dict(params, objective='multi:softprob', num_class=class_count, eval_metric='mlogloss',
+                        nthread=1)
+    start_time = time.time()
+    booster = xgb.train(train_params, dtrain, num_boost_round=num_boost_round, evals=[(dstop, 'stop')],
+                        early_stopping_rounds=early_stopping_rounds, verbose_eval=False)
+    train_seconds = time.time() - start_time
+
+    proba = booster.predict(dvalid, iteration_range=(0, booster.best_iteration + 1))
+    y_valid = dvalid.get_label()
+    result = {
+        'label': label_type,
+        'fold': fold_index,
+        'best_iteration': booster.best_iteration,
+        'accuracy': float((np.argmax(proba, axis=1) == y_valid).mean()),
+        'mlogloss': float(log_loss(y_valid, proba, labels=list(range(class_count)))),
+        'stop_mlogloss': float(booster.best_score),
+        'train_seconds': train_seconds
+    }
+    result.update(params)
+    return result
+
+
+def run_evaluation(data_path, param_grid, cache_root="data/evaluation_cache", n_splits=5, random_state=42,
+                   early_stopping_fraction=0.2, feature_names=None, n_jobs=-1, num_boost_round=500,
+                   early_stopping_rounds=20):
+    """
+    Cross validate every parameter candidate on every label, running the folds and candidates in parallel
+
+    :param data_path: path of the model input csv
+    :param param_grid: dict of XGBoost parameter name to candidate values
+    :param cache_root: folder that holds the fold matrix caches
+    :param n_splits: number of folds
+    :param random_state: seed of the fold split
+    :param early_stopping_fraction: fraction of each training fold held out for early stopping
+    :param feature_names: feature columns to evaluate on, all columns if None
+    :param n_jobs: number of parallel jobs, -1 for all cores
+    :param num_boost_round: maximum number of boosting rounds
+    :param early_stopping_rounds: rounds without improvement of the held out log loss before stopping
+    :return: (per fold result df, per label and parameter summary df)
+    """
+    cache_folder = get_cache_folder(data_path, cache_root, n_splits, random_state, early_stopping_fraction,
+                                    feature_names)
+    class_counts = prepare_fold_matrices(data_path, cache_folder, n_splits, random_state, early_stopping_fraction,
+                                         feature_names)
+
+    tasks = [
+        delayed(evaluate_fold)(cache_folder, label_type, class_counts[label_type], params, fold_index,
+                               num_boost_round, early_stopping_rounds)
+        for label_type in label_types
+        for params in ParameterGrid(param_grid)
+        for fold_index in range(n_splits)
+    ]
+    print("Running {} fold evaluations".format(len(tasks)))
+    fold_result_df = pd.DataFrame(Parallel(n_jobs=n_jobs, verbose=5)(tasks))
+
+    param_names = sorted(param_grid.keys())
+    summary_df = fold_result_df.groupby(['label'] + param_names).agg(
+        accuracy_mean=('accuracy', 'mean'),
+        accuracy_std=('accuracy', 'std'),
+        mlogloss_mean=('mlogloss', 'mean'),
+        stop_mlogloss_mean=('stop_mlogloss', 'mean'),
+        best_iteration_mean=('best_iteration', 'mean'),
+        train_seconds=('train_seconds', 'sum')
+    ).reset_index().sort_values(['label', 'accuracy_mean'], ascending=[True, False])
+    return fold_result_df, summary_df
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Cross validate XGBoost parameters on the model input")
+    parser.add_argument('--pruned-schema', action='store_true',
+                        help="evaluate only the feature columns of the compiled trees exported by feature_pruning.py")
+    args = parser.parse_args()
+
+    data_path = "data/model_input.csv"
+    compiled_trees_path = "data/xgb_pruned_trees.npz"
+    fold_result_path = "data/evaluation_folds.csv"
+    summary_path = "data/evaluation_results.csv"
+
+    param_grid = {
+        'max_depth': [3, 6],
+        'learning_rate': [0.1, 0.3],
+        'subsample': [0.8, 1.0],
+        'colsample_bytree': [0.5, 1.0]
+    }
+
+    feature_names = None
+    if args.pruned_schema:
+        feature_names = CompiledTreeEnsemble.load(compiled_trees_path).feature_names
+
+    start_time = time.time()
+    fold_result_df, summary_df = run_evaluation(data_path, param_grid, feature_names=feature_names)
+    fold_result_df.to_csv(fold_result_path, index=False)
+    summary_df.to_csv(summary_path, index=False)
+    print("Evaluation took {:.1f} seconds, results have been saved to {}.".format(time.time() - start_time,
+                                                                                  summary_path))
+    print(summary_df.groupby('label').head(1).to_string(index=False))
@@ -14,10 +14,10 @@ def handle_imbalanced_data(X, y):
 
     try:
         sampler = SMOTE(random_state=42)
-        return sampler.fit_sample(X, y)
+        return sampler.fit_resample(X, y)
     except Exception:
         sampler = RandomOverSampler(random_state=0)
-        return sampler.fit_sample(X, y)
+        return sampler.fit_resample(X, y)
 
 
 if __name__ == '__main__':
@@ -48,3 +48,6 @@ if __name__ == '__main__':
         clf.fit(X, y)
         clf.save_model(model_file_name)
         print("Training is complected, model is saved to {}".format(model_file_name))
+
+    # The scoring reads the compiled trees, which load_pruned_scoring() refuses to use until they are exported again
+    print("Run feature_pruning.py to export the compiled trees of the new models.")
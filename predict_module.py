@@ -1,60 +1,373 @@
+import codecs
+import copy
+import json
 import os
+import queue
+import subprocess
+import sys
+import tempfile
+import threading
 
+from data_preprocess import DataPreprocessor, load_translation_gate
 from feature.feature import features
 from feature_preprocess import *
-from util import read_json_file
+from tree_evaluator import CompiledTreeEnsemble
+from util import get_files_fingerprint, read_json_file
 from util import replace_invalid_field_name_characters
 
+model_names = ['cv', 'nlp', 'tool']
 
-def get_personal_profile_df(profile_url):
-    command = r"node ./crawler/profileCrawler.js {}".format(profile_url)
-    os.system(command)
-    profile_json = read_json_file("data/profile.json")
-    profile_data = flatten_json(profile_json)
-    profile_data_transformed = fetch_required_fields_and_rename(profile_data)
+# Files the compiled trees are exported from, the export is stale once one of them changes
+scoring_source_paths = [
+    "data/xgb_cv.model",
+    "data/xgb_nlp.model",
+    "data/xgb_tool.model",
+    "data/companyTypeOneHotEncoder.pickle",
+    "data/nameTokensOneHotEncoder.pickle",
+    "data/educationTypeOneHotEncoder.pickle",
+    "data/positionTokenOneHotEncoder.pickle",
+    "data/dateRangeFeatureTransformer.pickle",
+]
+
+
+def load_xgb_model(model_file_name):
+    # Only needed to export the models, scoring uses the compiled trees
+    from xgboost import XGBClassifier
+
+    clf = XGBClassifier()
+    clf.load_model(model_file_name)
+    return clf
+
+
+def load_object(file_name):
+    print("Load object from {}".format(file_name))
+    return joblib.load(file_name)
+
+
+def load_feature_preprocessor():
+    company_type_one_hot_encoder = load_object(file_name="data/companyTypeOneHotEncoder.pickle")
+    name_tokens_one_hot_encoder = load_object(file_name="data/nameTokensOneHotEncoder.pickle")
+    education_type_one_hot_encoder = load_object(file_name="data/educationTypeOneHotEncoder.pickle")
+    position_token_one_hot_encoder = load_object(file_name="data/positionTokenOneHotEncoder.pickle")
+    date_range_feature_transformer = load_object(file_name="data/dateRangeFeatureTransformer.pickle")
+
+    return FeaturePreprocessor(
+        company_type_one_hot_encoder,
+        name_tokens_one_hot_encoder,
+        education_type_one_hot_encoder,
+        position_token_one_hot_encoder,
+        date_range_feature_transformer,
+    )
+
+
+def load_data_preprocessor():
+    # Translate with the same gate setting as the data the encoders were fitted on
+    return DataPreprocessor(load_translation_gate())
+
+
+def load_xgb_models():
+    cv_clf_path = "data/xgb_cv.model"
+    nlp_clf_path = "data/xgb_nlp.model"
+    tool_clf_path = "data/xgb_tool.model"
+    print("Load model from {}".format(cv_clf_path))
+    print("Load model from {}".format(nlp_clf_path))
+    print("Load model from {}".format(tool_clf_path))
+    cv_clf = load_xgb_model(cv_clf_path)
+    nlp_clf = load_xgb_model(nlp_clf_path)
+    tool_clf = load_xgb_model(tool_clf_path)
+    return cv_clf, nlp_clf, tool_clf
+
+
+def load_pruned_scoring(compiled_trees_path="data/xgb_pruned_trees.npz"):
+    """
+    Load the feature preprocessor pruned to the columns of the compiled trees exported by feature_pruning.py, the
+    feature names saved with the trees are the pruned schema. XGBoost is not needed.
+
+    :param compiled_trees_path: path of the compiled trees
+    :return: tuple of the pruned FeaturePreprocessor and the CompiledTreeEnsemble that reads its output
+    :raises ValueError: if the models or encoders changed since the trees were exported
+    """
+    ensemble = CompiledTreeEnsemble.load(compiled_trees_path)
+    if ensemble.metadata.get('source_fingerprint') != get_files_fingerprint(scoring_source_paths):
+        raise ValueError("{} was exported from other models or encoders, run feature_pruning.py to export it "
+                         "again".format(compiled_trees_path))
+    feature_preprocessor = load_feature_preprocessor()
+    feature_preprocessor.prune(ensemble.feature_names)
+    feature_names = list(map(replace_invalid_field_name_characters, feature_preprocessor.get_feature_names()))
+    return feature_preprocessor, ensemble.select_features(feature_names)
+
+
+def score_feature_df(feature_df, ensemble):
+    """
+    :param feature_df: one-row feature df of the pruned FeaturePreprocessor
+    :param ensemble: CompiledTreeEnsemble from load_pruned_scoring()
+    :return: tuple of the cv, nlp and tool scores
+    """
+    predictions = ensemble.predict(feature_df.values)
+    return tuple(predictions[model_name][0] for model_name in model_names)
+
+
+def get_personal_profile_df(profile_url, profile_path="data/profile.json"):
+    # The url is passed as an argument rather than through a shell, a failed crawl raises CalledProcessError
+    subprocess.run(["node", "./crawler/profileCrawler.js", profile_url, profile_path], check=True)
+    profile_json = read_json_file(profile_path)
+    profile_data_transformed = required_fields_extractor.extract(profile_json)
     return pd.DataFrame(profile_data_transformed, index=[0])
 
 
-def flatten_json(y):
-    out = {}
+class JsonPathExtractor:
+    """
+    Fetch the fields declared by the features straight from a nested profile json, walking only the required paths.
+    A path that is missing or does not end on a leaf value gives None.
+    """
+
+    def __init__(self, features):
+        self.compiled_paths = []
+        for feature in features:
+            for json_field, csv_field in feature.get_json_to_csv_field_mapping().items():
+                keys = [int(key) if key.isdigit() else key for key in json_field.split('/')]
+                self.compiled_paths.append((csv_field, keys))
+
+    def get_csv_field_names(self):
+        return [csv_field for csv_field, _ in self.compiled_paths]
+
+    def extract(self, profile_json):
+        result = {}
+        for csv_field, keys in self.compiled_paths:
+            result[csv_field] = self.extract_path(profile_json, keys)
+        return result
+
+    @staticmethod
+    def extract_path(profile_json, keys):
+        value = profile_json
+        for key in keys:
+            if type(value) is list and type(key) is int and key < len(value):
+                value = value[key]
+            elif type(value) is dict and str(key) in value:
+                value = value[str(key)]
+            else:
+                return None
+
+        if type(value) is dict or type(value) is list:
+            return None
+        return value
+
 
-    def flatten(x, name=''):
-        if type(x) is dict:
-            for a in x:
-                flatten(x[a], name + a + '/')
-        elif type(x) is list:
-            i = 0
-            for a in x:
-                flatten(a, name + str(i) + '/')
-                i += 1
-        else:
-            out[name[:-1]] = x
+required_fields_extractor = JsonPathExtractor(features)
 
-    flatten(y)
-    return out
 
+def read_profiles_jsonl_as_df(file_path, extractor=required_fields_extractor):
+    """
+    Read a JSONL file with one scraped profile per line into a df with one row per profile and the required fields
+    as columns.
 
-def fetch_required_fields_and_rename(profile_data):
-    mappings = {}
+    :param file_path: path of the JSONL file
+    :param extractor: JsonPathExtractor used to fetch the required fields
+    :return: a df with the csv field names as columns
+    """
+    columns = {csv_field: [] for csv_field in extractor.get_csv_field_names()}
+    with codecs.open(file_path, "r", encoding='utf-8', errors='ignore') as fdata:
+        for line in fdata:
+            if not line.strip():
+                continue
+            profile_json = json.loads(line)
+            for csv_field, keys in extractor.compiled_paths:
+                columns[csv_field].append(extractor.extract_path(profile_json, keys))
+    return pd.DataFrame(columns)
 
-    for feature in features:
-        mappings.update(feature.get_json_to_csv_field_mapping())
-    result = {}
 
-    for key, value in mappings.items():
-        result[value] = profile_data.get(key, None)
-    return result
 
 
 
+# Put once by the last running worker of a pipeline stage when its input is exhausted
+PIPELINE_END = None
+# Returned instead of an item once the consumer of the pipeline has stopped
+PIPELINE_STOPPED = object()
+
+
+def crawl_profile_df(profile_url):
+    """
+    Crawl a profile to its own temporary file, so that several crawls can run at the same time
+
+    :param profile_url: LinkedIn profile url
+    :return: one-row df with the required fields
+    """
+    fd, profile_path = tempfile.mkstemp(prefix="profile_", suffix=".json", dir="data")
+    os.close(fd)
+    try:
+        return get_personal_profile_df(profile_url, profile_path=profile_path)
+    finally:
+        os.remove(profile_path)
+
+
+def put_until_stopped(output_queue, item, stop_event):
+    """
+    :return: True if the item was put, False if the pipeline stopped while the queue was full
+    """
+    while not stop_event.is_set():
+        try:
+            output_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def get_until_stopped(input_queue, stop_event):
+    """
+    :return: the next item, PIPELINE_STOPPED if the pipeline stopped while the queue was empty
+    """
+    while not stop_event.is_set():
+        try:
+            return input_queue.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return PIPELINE_STOPPED
+
+
+class StageWorkerCount:
+    """
+    Number of running workers of a pipeline stage, shared by the workers so the last one can end the stage
+    """
+
+    def __init__(self, count):
+        self.count = count
+        self.lock = threading.Lock()
+
+    def end_worker(self):
+        """
+        :return: True if the calling worker was the last running one
+        """
+        with self.lock:
+            self.count -= 1
+            return self.count == 0
+
+
+def run_pipeline_stage(function, input_queue, output_queue, stop_event, worker_count):
+    """
+    Apply a function to the items of a pipeline stage until the upstream stage has ended or the pipeline stopped.
+    Items are tuples of (profile_url, value, error), items with an error are passed on untouched.
+
+    :param function: function applied to the value of each item
+    :param input_queue: queue to read items from
+    :param output_queue: queue to put the processed items to
+    :param stop_event: event set when the consumer of the pipeline has stopped
+    :param worker_count: StageWorkerCount shared by the workers of the stage
+    """
+    while True:
+        item = get_until_stopped(input_queue, stop_event)
+        if item is PIPELINE_STOPPED:
+            return
+        if item is PIPELINE_END:
+            # Put the end back for the other workers of the stage, the last one passes it downstream
+            put_until_stopped(input_queue, PIPELINE_END, stop_event)
+            if worker_count.end_worker():
+                put_until_stopped(output_queue, PIPELINE_END, stop_event)
+            return
+
+        profile_url, value, error = item
+        if error is None:
+            try:
+                value = function(value)
+            except Exception as e:
+                value, error = None, e
+        if not put_until_stopped(output_queue, (profile_url, value, error), stop_event):
+            return
+
+
+def run_prediction_pipeline(profile_urls, data_preprocessor, feature_preprocessor, ensemble, crawl_workers=4,
+                            translate_workers=2, queue_size=8):
+    """
+    Score a list or stream of profile urls with the crawl, translate, encode and score stages running at the same
+    time, connected by bounded queues. Several crawls and translations run concurrently while earlier profiles are
+    encoded and scored, and a full queue blocks its upstream stage so that memory stays bounded. Closing the generator
+    early stops all the stages.
+
+    A profile takes about twice as long to crawl as to translate, so the default of 2 translate workers keeps up with
+    4 crawl workers. More crawl workers only pay off with more translate workers.
+
+    :param profile_urls: iterable of LinkedIn profile urls
+    :param data_preprocessor: a DataPreprocessor, every translate worker gets its own copy as the translators keep
+        state
+    :param feature_preprocessor: the pruned FeaturePreprocessor from load_pruned_scoring()
+    :param ensemble: the CompiledTreeEnsemble from load_pruned_scoring()
+    :param crawl_workers: number of concurrent crawls
+    :param translate_workers: number of concurrent translations
+    :param queue_size: maximum number of profiles waiting between two stages
+    :return: generator of (profile_url, (cv, nlp, tool) scores, error) in completion order, scores are None and error
+        is the exception if the profile failed, profile_url is also None if reading profile_urls failed
+    """
+    url_queue = queue.Queue(maxsize=queue_size)
+    profile_queue = queue.Queue(maxsize=queue_size)
+    preprocessed_queue = queue.Queue(maxsize=queue_size)
+    feature_queue = queue.Queue(maxsize=queue_size)
+    stop_event = threading.Event()
+
+    def feed_urls():
+        try:
+            for profile_url in profile_urls:
+                if not put_until_stopped(url_queue, (profile_url, profile_url, None), stop_event):
+                    return
+        except Exception as e:
+            # e.g. a bad line of a streamed source, the urls read so far are still scored
+            put_until_stopped(url_queue, (None, None, e), stop_event)
+        finally:
+            put_until_stopped(url_queue, PIPELINE_END, stop_event)
+
+    threads = [threading.Thread(target=feed_urls, daemon=True)]
+    crawl_worker_count = StageWorkerCount(crawl_workers)
+    for _ in range(crawl_workers):
+        threads.append(threading.Thread(target=run_pipeline_stage, daemon=True,
+                                        args=(crawl_profile_df, url_queue, profile_queue, stop_event,
+                                              crawl_worker_count)))
+    translate_worker_count = StageWorkerCount(translate_workers)
+    for _ in range(translate_workers):
+        threads.append(threading.Thread(target=run_pipeline_stage, daemon=True,
+                                        args=(copy.deepcopy(data_preprocessor).transform, profile_queue,
+                                              preprocessed_queue, stop_event, translate_worker_count)))
+    threads.append(threading.Thread(target=run_pipeline_stage, daemon=True,
+                                    args=(feature_preprocessor.transform, preprocessed_queue, feature_queue,
+                                          stop_event, StageWorkerCount(1))))
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            item = feature_queue.get()
+            if item is PIPELINE_END:
+                break
+
+            profile_url, feature_df, error = item
+            scores = None
+            if error is None:
+                try:
+                    scores = score_feature_df(feature_df, ensemble)
+                except Exception as e:
+                    error = e
+            yield profile_url, scores, error
+    finally:
+        # Also runs when the caller closes the generator early, the stages then stop instead of blocking on full
+        # queues
+        stop_event.set()
 
 
 if __name__ == '__main__':
     # https://www.linkedin.com/in/chungkaihsieh/
     # nltk.download('punkt')
-    # data_preprocessor = DataPreprocessor()
-    # feature_preprocessor = load_feature_preprocessor()
-    # cv_clf, nlp_clf, tool_clf = load_xgb_models()
+    data_preprocessor = load_data_preprocessor()
+    feature_preprocessor, ensemble = load_pruned_scoring()
+
+    if len(sys.argv) > 1:
+        # Score the profile urls of the given file, one url per line
+        with open(sys.argv[1]) as url_file:
+            profile_urls = (line.strip() for line in url_file if line.strip())
+            pipeline = run_prediction_pipeline(profile_urls, data_preprocessor, feature_preprocessor, ensemble)
+            for profile_url, scores, error in pipeline:
+                if error is not None:
+                    print("{} failed: {}".format(profile_url, error))
+                else:
+                    print("{} CV : {}, NLP : {}, TOOL : {}".format(profile_url, *scores))
+        sys.exit()
 
     should_continue = True
     while should_continue:
@@ -66,10 +379,7 @@ if __name__ == '__main__':
 
         preprocessed_data_df = data_preprocessor.transform(profile_df)
         feature_df = feature_preprocessor.transform(preprocessed_data_df)
-        feature_df = feature_df.rename(columns=replace_invalid_field_name_characters)
-        cv_y_pred = cv_clf.predict(feature_df)[0]
-        nlp_y_pred = nlp_clf.predict(feature_df)[0]
-        tool_y_pred = tool_clf.predict(feature_df)[0]
+        cv_y_pred, nlp_y_pred, tool_y_pred = score_feature_df(feature_df, ensemble)
 
         score = "CV : {}, NLP : {}, TOOL : {}".format(cv_y_pred, nlp_y_pred, tool_y_pred)
 
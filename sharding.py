@@ -0,0 +1,117 @@
+import copy
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.base import BaseEstimator, TransformerMixin
+
+PROCESS_BACKEND = "process"
+THREAD_BACKEND = "thread"
+
+# Fitted transformer of the current worker process, set once by init_worker instead of being sent with every shard
+worker_transformer = None
+
+
+def init_worker(transformer):
+    global worker_transformer
+    worker_transformer = transformer
+
+
+def transform_shard(shard_df):
+    return transform_with_stats(worker_transformer, shard_df)
+
+
+def transform_with_stats(transformer, shard_df):
+    """
+    Transform a shard, transformers with get_transform_stats() like DataPreprocessor also return their stats of the
+    shard so they can be reported once for all shards
+
+    :param transformer: transformer to run
+    :param shard_df: shard df
+    :return: tuple of the transformed df and the stats, None if the transformer has no stats
+    """
+    if hasattr(transformer, 'get_transform_stats'):
+        return transformer.transform(shard_df, report_stats=False), transformer.get_transform_stats()
+    return transformer.transform(shard_df), None
+
+
+def merge_transform_stats(stats_list):
+    """
+    :param stats_list: list of dict of name to tuple of counts
+    :return: dict of name to tuple of the counts summed over all dicts
+    """
+    merged_stats = {}
+    for stats in stats_list:
+        for name, counts in stats.items():
+            merged_counts = merged_stats.get(name, (0,) * len(counts))
+            merged_stats[name] = tuple(merged + count for merged, count in zip(merged_counts, counts))
+    return merged_stats
+
+
+def split_into_shards(df, shard_count):
+    """
+    Split a df into row shards with a fresh index, as the preprocessors build their output with a 0-based index
+
+    :param df: input df
+    :param shard_count: number of shards
+    :return: list of df
+    """
+    row_indices = np.array_split(np.arange(len(df)), min(shard_count, len(df)))
+    return [df.iloc[indices].reset_index(drop=True) for indices in row_indices]
+
+
+class ShardedTransformer(BaseEstimator, TransformerMixin):
+    """
+    Run the transform() of a fitted transformer like DataPreprocessor or FeaturePreprocessor on row shards in
+    parallel, the output rows keep the order of the input rows.
+
+    With the process backend every worker process gets the fitted transformer once when it starts and uses it read
+    only. The thread backend suits the I/O-bound translation of DataPreprocessor, every shard then gets its own copy
+    of the transformer since the translators keep state.
+    """
+
+    def __init__(self, transformer, n_jobs=None, shards_per_job=4, backend=PROCESS_BACKEND):
+        """
+        :param transformer: transformer to run on the shards
+        :param n_jobs: number of workers, os.cpu_count() if None
+        :param shards_per_job: number of shards per worker, more shards balance the load better
+        :param backend: PROCESS_BACKEND or THREAD_BACKEND
+        """
+        self.transformer = transformer
+        self.n_jobs = n_jobs
+        self.shards_per_job = shards_per_job
+        self.backend = backend
+
+    def fit(self, X, y=None, **fit_params):
+        # Fitting has to see the whole corpus, so it is not sharded
+        if hasattr(self.transformer, 'fit'):
+            self.transformer.fit(X, y, **fit_params)
+        return self
+
+    def transform(self, X, **transform_params):
+        n_jobs = self.n_jobs or os.cpu_count()
+        if n_jobs == 1 or len(X) <= 1:
+            return self.transformer.transform(X)
+
+        shards = split_into_shards(X, n_jobs * self.shards_per_job)
+        print("Transforming {} rows in {} shards with {} {} workers".format(len(X), len(shards), n_jobs,
+                                                                            self.backend))
+        if self.backend == PROCESS_BACKEND:
+            with ProcessPoolExecutor(max_workers=n_jobs, initializer=init_worker,
+                                     initargs=(self.transformer,)) as executor:
+                shard_results = list(executor.map(transform_shard, shards))
+        elif self.backend == THREAD_BACKEND:
+            with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+                shard_results = list(executor.map(
+                    lambda shard_df: transform_with_stats(copy.deepcopy(self.transformer), shard_df), shards))
+        else:
+            raise ValueError("Unknown backend: {}".format(self.backend))
+
+        shard_stats = [stats for _, stats in shard_results if stats is not None]
+        if shard_stats:
+            self.transformer.report_transform_stats(merge_transform_stats(shard_stats))
+
+        result_df = pd.concat([shard_df for shard_df, _ in shard_results], axis=0, ignore_index=True)
+        result_df.index = X.index
+        return result_df
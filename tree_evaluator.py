@@ -0,0 +1,362 @@
+import json
+import os
+import time
+
+import numpy as np
+
+os.environ['KMP_DUPLICATE_LIB_OK'] = 'True'
+
+
+class CompiledTreeEnsemble:
+    """
+    The trees of several XGBoost models flattened into arrays, so that all trees of all models can be evaluated at
+    once with NumPy only.
+
+    Every node of every tree is one entry of the node arrays. A split node sends a row to `yes` when the feature value
+    is smaller than the threshold, to `no` otherwise and to `missing` when the value is NaN. A leaf node points to
+    itself, so walking `max_depth` steps from the roots always ends on the leaves.
+    """
+
+    def __init__(self, metadata, split_feature, threshold, yes, no, missing, leaf_value, tree_root, tree_output):
+        """
+        :param metadata: dict with 'feature_names', 'max_depth' and 'models', a list of dict with 'name', 'objective',
+            'num_output', 'output_offset', 'base_margin' and 'classes' per model, feature_pruning.py also sets
+            'source_fingerprint' of the files the trees are exported from
+        :param split_feature: feature index of each node, -1 for leaves
+        :param threshold: split threshold of each node
+        :param yes: next node of each node when value < threshold
+        :param no: next node of each node when value >= threshold
+        :param missing: next node of each node when value is NaN
+        :param leaf_value: leaf value of each node, 0 for split nodes
+        :param tree_root: root node of each tree
+        :param tree_output: margin column of each tree
+        """
+        self.metadata = metadata
+        self.split_feature = split_feature
+        self.threshold = threshold
+        self.yes = yes
+        self.no = no
+        self.missing = missing
+        self.leaf_value = leaf_value
+        self.tree_root = tree_root
+        self.tree_output = tree_output
+
+        num_output = sum(model['num_output'] for model in metadata['models'])
+        self.tree_output_matrix = np.zeros((len(tree_root), num_output), dtype=np.float32)
+        self.tree_output_matrix[np.arange(len(tree_root)), tree_output] = 1
+        self.base_margin = np.zeros(num_output, dtype=np.float32)
+        for model in metadata['models']:
+            offset = model['output_offset']
+            self.base_margin[offset:offset + model['num_output']] = model['base_margin']
+
+    @property
+    def feature_names(self):
+        return self.metadata['feature_names']
+
+    @property
+    def model_names(self):
+        return [model['name'] for model in self.metadata['models']]
+
+    def predict_margin(self, X, batch_size=1024):
+        """
+        Given a feature matrix, return the raw margins of all models
+
+        :param X: feature matrix with the columns in the order of feature_names
+        :param batch_size: number of rows evaluated at once
+        :return: margin matrix of shape (rows, total outputs of all models)
+        """
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+
+        margins = []
+        for batch_start in range(0, X.shape[0], batch_size):
+            X_batch = X[batch_start:batch_start + batch_size]
+            rows = np.arange(X_batch.shape[0])[:, None]
+            node = np.broadcast_to(self.tree_root, (X_batch.shape[0], len(self.tree_root)))
+            for _ in range(self.metadata['max_depth']):
+                value = X_batch[rows, np.maximum(self.split_feature[node], 0)]
+                next_node = np.where(value < self.threshold[node], self.yes[node], self.no[node])
+                node = np.where(np.isnan(value), self.missing[node], next_node)
+            margins.append(self.leaf_value[node].dot(self.tree_output_matrix) + self.base_margin)
+        return np.concatenate(margins, axis=0)
+
+    def predict_proba(self, X, batch_size=1024):
+        """
+        Given a feature matrix, return the class probabilities of every model
+
+        :param X: feature matrix with the columns in the order of feature_names
+        :param batch_size: number of rows evaluated at once
+        :return: dict of model name to probability matrix of shape (rows, classes)
+        """
+        margins = self.predict_margin(X, batch_size=batch_size)
+        result = {}
+        for model in self.metadata['models']:
+            offset = model['output_offset']
+            margin = margins[:, offset:offset + model['num_output']]
+            result[model['name']] = transform_margin(margin, model['objective'])
+        return result
+
+    def predict(self, X, batch_size=1024):
+        """
+        Given a feature matrix, return the predicted labels of every model like XGBClassifier.predict does
+
+        :param X: feature matrix with the columns in the order of feature_names
+        :param batch_size: number of rows evaluated at once
+        :return: dict of model name to label array
+        """
+        result = {}
+        for model_name, proba in self.predict_proba(X, batch_size=batch_size).items():
+            classes = np.asarray(self.get_model(model_name)['classes'])
+            result[model_name] = classes[np.argmax(proba, axis=1)]
+        return result
+
+    def get_used_feature_names(self):
+        """
+        :return: names of the features that at least one tree splits on
+        """
+        used_feature_indices = np.unique(self.split_feature[self.split_feature >= 0])
+        return [self.feature_names[i] for i in used_feature_indices]
+
+    def select_features(self, feature_names):
+        """
+        Return a copy that reads a feature matrix with the given columns only, e.g. the output of a pruned
+        FeaturePreprocessor
+
+        :param feature_names: column names of the new feature matrix, must contain all used features
+        :return: a CompiledTreeEnsemble
+        """
+        new_feature_index = {name: i for i, name in enumerate(feature_names)}
+        missing_feature_names = set(self.get_used_feature_names()) - set(new_feature_index)
+        if missing_feature_names:
+            raise ValueError("Used features are missing: {}".format(sorted(missing_feature_names)))
+
+        index_mapping = np.full(max(len(self.feature_names), 1), -1, dtype=np.int32)
+        for i, name in enumerate(self.feature_names):
+            index_mapping[i] = new_feature_index.get(name, -1)
+        split_feature = np.where(self.split_feature >= 0, index_mapping[np.maximum(self.split_feature, 0)], -1)
+
+        metadata = dict(self.metadata, feature_names=list(feature_names))
+        return CompiledTreeEnsemble(metadata, split_feature.astype(np.int32), self.threshold, self.yes, self.no,
+                                    self.missing, self.leaf_value, self.tree_root, self.tree_output)
+
+    def get_model(self, model_name):
+        for model in self.metadata['models']:
+            if model['name'] == model_name:
+                return model
+        raise KeyError(model_name)
+
+    def save(self, file_name):
+        print("Save compiled trees to {}".format(file_name))
+        np.savez_compressed(
+            file_name,
+            metadata=np.array(json.dumps(self.metadata)),
+            split_feature=self.split_feature,
+            threshold=self.threshold,
+            yes=self.yes,
+            no=self.no,
+            missing=self.missing,
+            leaf_value=self.leaf_value,
+            tree_root=self.tree_root,
+            tree_output=self.tree_output
+        )
+
+    @classmethod
+    def load(cls, file_name):
+        print("Load compiled trees from {}".format(file_name))
+        with np.load(file_name, allow_pickle=False) as data:
+            return cls(
+                json.loads(str(data['metadata'])),
+                data['split_feature'],
+                data['threshold'],
+                data['yes'],
+                data['no'],
+                data['missing'],
+                data['leaf_value'],
+                data['tree_root'],
+                data['tree_output']
+            )
+
+
+def transform_margin(margin, objective):
+    """
+    Turn raw margins to probabilities the same way the XGBoost objective does
+
+    :param margin: margin matrix of shape (rows, outputs) of one model
+    :param objective: XGBoost objective name
+    :return: probability matrix of shape (rows, classes)
+    """
+    if objective in ('multi:softprob', 'multi:softmax'):
+        exp_margin = np.exp(margin - margin.max(axis=1, keepdims=True))
+        return exp_margin / exp_margin.sum(axis=1, keepdims=True)
+    elif objective.startswith('binary:'):
+        proba = 1 / (1 + np.exp(-margin[:, 0]))
+        return np.stack([1 - proba, proba], axis=1)
+    return margin
+
+
+def compile_xgb_models(models, model_names, feature_names=None):
+    """
+    Flatten the trees of several XGBoost models into a CompiledTreeEnsemble
+
+    :param models: list of XGBClassifier or Booster
+    :param model_names: list of model names like ['cv', 'nlp', 'tool']
+    :param feature_names: column names of the model input, only needed when the boosters have no feature names
+    :return: a CompiledTreeEnsemble
+    """
+    nodes = {'split_feature': [], 'threshold': [], 'yes': [], 'no': [], 'missing': [], 'leaf_value': []}
+    tree_root = []
+    tree_output = []
+    model_metadata = []
+    max_depth = 0
+    output_offset = 0
+
+    for model, model_name in zip(models, model_names):
+        booster = model.get_booster() if hasattr(model, 'get_booster') else model
+        if feature_names is None:
+            feature_names = booster.feature_names
+        feature_index = {name: i for i, name in enumerate(feature_names or [])}
+
+        config = json.loads(booster.save_config())
+        objective = config['learner']['objective']['name']
+        num_class = int(config['learner']['learner_model_param']['num_class'])
+        # newer XGBoost versions write base_score as a vector like '[5E-1]'
+        base_score = float(config['learner']['learner_model_param']['base_score'].strip('[]'))
+        num_output = max(num_class, 1)
+        if objective == 'binary:logistic':
+            base_margin = float(np.log(base_score / (1 - base_score)))
+        else:
+            base_margin = base_score
+        classes = getattr(model, 'classes_', None)
+        if classes is None:
+            classes = np.arange(max(num_output, 2))
+
+        for tree_index, tree_dump in enumerate(booster.get_dump(dump_format='json')):
+            tree_root.append(len(nodes['leaf_value']))
+            tree_output.append(output_offset + tree_index % num_output)
+            depth = append_tree_nodes(json.loads(tree_dump), nodes, feature_index)
+            max_depth = max(max_depth, depth)
+
+        model_metadata.append({
+            'name': model_name,
+            'objective': objective,
+            'num_output': num_output,
+            'output_offset': output_offset,
+            'base_margin': base_margin,
+            'classes': [int(label) for label in classes]
+        })
+        output_offset += num_output
+
+    metadata = {
+        'feature_names': list(feature_names) if feature_names is not None else None,
+        'max_depth': max_depth,
+        'models': model_metadata
+    }
+    return CompiledTreeEnsemble(
+        metadata,
+        np.array(nodes['split_feature'], dtype=np.int32),
+        np.array(nodes['threshold'], dtype=np.float32),
+        np.array(nodes['yes'], dtype=np.int32),
+        np.array(nodes['no'], dtype=np.int32),
+        np.array(nodes['missing'], dtype=np.int32),
+        np.array(nodes['leaf_value'], dtype=np.float32),
+        np.array(tree_root, dtype=np.int32),
+        np.array(tree_output, dtype=np.int32)
+    )
+
+
+def append_tree_nodes(tree, nodes, feature_index):
+    """
+    Append the nodes of one json tree dump to the node arrays
+
+    :param tree: root node of a tree from Booster.get_dump(dump_format='json')
+    :param nodes: dict of node arrays to append to
+    :param feature_index: dict of feature name to column index
+    :return: depth of the tree
+    """
+    # nodeid is only unique within a tree, so map it to the position in the node arrays
+    offset = len(nodes['leaf_value'])
+    tree_nodes = []
+    stack = [(tree, 0)]
+    depth = 0
+    while stack:
+        node, node_depth = stack.pop()
+        tree_nodes.append(node)
+        depth = max(depth, node_depth)
+        for child in node.get('children', []):
+            stack.append((child, node_depth + 1))
+
+    tree_nodes.sort(key=lambda tree_node: tree_node['nodeid'])
+    position = {tree_node['nodeid']: offset + i for i, tree_node in enumerate(tree_nodes)}
+    for tree_node in tree_nodes:
+        node_position = position[tree_node['nodeid']]
+        if 'leaf' in tree_node:
+            nodes['split_feature'].append(-1)
+            nodes['threshold'].append(0)
+            nodes['yes'].append(node_position)
+            nodes['no'].append(node_position)
+            nodes['missing'].append(node_position)
+            nodes['leaf_value'].append(tree_node['leaf'])
+        else:
+            split = tree_node['split']
+            if split in feature_index:
+                nodes['split_feature'].append(feature_index[split])
+            else:
+                # boosters without feature names dump splits like 'f123'
+                nodes['split_feature'].append(int(split[1:]))
+            nodes['threshold'].append(tree_node['split_condition'])
+            nodes['yes'].append(position[tree_node['yes']])
+            nodes['no'].append(position[tree_node['no']])
+            nodes['missing'].append(position[tree_node['missing']])
+            nodes['leaf_value'].append(0)
+    return depth
+
+
+def measure_latency(predict_function, repeat=100):
+    start_time = time.time()
+    for _ in range(repeat):
+        predict_function()
+    return (time.time() - start_time) / repeat * 1000
+
+
+if __name__ == '__main__':
+    from xgboost import XGBClassifier
+
+    from util import read_csv_file_as_df, replace_invalid_field_name_characters
+
+    data_path = "data/model_input.csv"
+    compiled_trees_path = "data/xgb_trees.npz"
+    model_names = ['cv', 'nlp', 'tool']
+
+    input_data = read_csv_file_as_df(data_path)
+    input_data = input_data.rename(columns=replace_invalid_field_name_characters)
+    X = input_data.drop('CV', 1).drop('Tool', 1).drop('NLP', 1)
+
+    models = []
+    for model_name in model_names:
+        clf = XGBClassifier()
+        clf.load_model("data/xgb_{}.model".format(model_name))
+        models.append(clf)
+
+    ensemble = compile_xgb_models(models, model_names, feature_names=list(X.columns))
+    ensemble.save(compiled_trees_path)
+    ensemble = CompiledTreeEnsemble.load(compiled_trees_path)
+
+    X_values = X.values.astype(np.float32)
+    ensemble_proba = ensemble.predict_proba(X_values)
+    ensemble_pred = ensemble.predict(X_values)
+    for model_name, clf in zip(model_names, models):
+        max_diff = np.abs(clf.predict_proba(X) - ensemble_proba[model_name]).max()
+        label_match = (clf.predict(X) == ensemble_pred[model_name]).mean()
+        print("{}: max probability difference {:.2e}, label match {:.2%}".format(model_name, max_diff, label_match))
+
+    single_row_df = X.iloc[[0]]
+    single_row = X_values[:1]
+    xgb_latency = measure_latency(lambda: [clf.predict(single_row_df) for clf in models])
+    ensemble_latency = measure_latency(lambda: ensemble.predict(single_row))
+    print("Single row latency: XGBoost {:.3f} ms, compiled trees {:.3f} ms".format(xgb_latency, ensemble_latency))
+
+    xgb_latency = measure_latency(lambda: [clf.predict(X) for clf in models], repeat=10)
+    ensemble_latency = measure_latency(lambda: ensemble.predict(X_values), repeat=10)
+    print("{} rows latency: XGBoost {:.3f} ms, compiled trees {:.3f} ms".format(
+        len(X_values), xgb_latency, ensemble_latency))
@@ -1,4 +1,5 @@
 import codecs
+import hashlib
 import json
 
 import pandas as pd
@@ -22,3 +23,15 @@ def read_csv_file_as_df(file_path):
 def build_query_by_feature(feature, input_df_name="input_data"):
     field_names = ["`{}`".format(field_name) for field_name in feature.get_csv_field_names()]
     return 'select {} from {};'.format(", ".join(field_names), input_df_name)
+
+
+def get_files_fingerprint(file_paths):
+    """
+    :param file_paths: list of file paths
+    :return: md5 hex digest of the contents of the files in the given order
+    """
+    md5 = hashlib.md5()
+    for file_path in file_paths:
+        with open(file_path, "rb") as fdata:
+            md5.update(fdata.read())
+    return md5.hexdigest()